@@ -1,82 +1,178 @@
+import os
+import shutil
 import pathlib
-import json
+import threading
 import numpy as np
-import faiss
 import requests  # Use the synchronous requests library
 from sentence_transformers import SentenceTransformer
+from documind.core.ingest_queue import IngestionQueue
+from documind.core.extraction import ExtractionStage, PageTextCache, TesseractOcr
+from documind.core.collection import (
+    Collection, MetadataFilter, is_valid_collection_name, INDEX_FILE_NAME, LEGACY_LIBRARY_FILE_NAME
+)
 
 # --- Constants ---
-DATA_PATH = pathlib.Path("./documind_data")
-INDEX_FILE_PATH = DATA_PATH / "documind_index.faiss"
-LIBRARY_FILE_PATH = DATA_PATH / "documind_library.json"
-EMBED_MODEL = 'all-MiniLM-L6-v2'
-VECTOR_DIMENSION = 384
+DATA_PATH = pathlib.Path(os.environ.get("DOCUMIND_DATA_PATH", pathlib.Path.home() / ".documind")).expanduser()
+COLLECTIONS_PATH = DATA_PATH / "collections"
+INGEST_QUEUE_PATH = DATA_PATH / "ingest_jobs.sqlite3"
+EXTRACTION_CACHE_PATH = DATA_PATH / "extraction_cache.sqlite3"
+OCR_LANGUAGE = os.environ.get("DOCUMIND_OCR_LANGUAGE", "eng")
+LEGACY_DATA_PATH = pathlib.Path("./documind_data")
+DEFAULT_COLLECTION = "default"
+COLLECTION_IDLE_SECONDS = 600
+EMBED_MODEL = os.environ.get("DOCUMIND_EMBED_MODEL", 'all-MiniLM-L6-v2')
+# 'float32', 'float16' or 'int8' (scalar quantized); existing libraries are converted on load
+VECTOR_STORAGE = os.environ.get("DOCUMIND_VECTOR_STORAGE", 'float32')
+# Open indexes memory-mapped so startup is near-instant and processes share the page cache
+USE_MMAP = os.environ.get("DOCUMIND_MMAP_INDEX", "1") != "0"
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 
 class AICore:
-    # ... (__init__ and all other methods before generate_response are unchanged) ...
     def __init__(self, status_callback=None):
-        self.log = lambda message: print(f"[LOG] {message}") if status_callback is None else status_callback(message)
+        self.set_status_callback(status_callback)
         self.log("AI Core: Initializing...")
         self.embedding_model = None
-        self.index = None
-        self.document_map = [] 
+        self.vector_dimension = None
+        self.collections: dict[str, Collection] = {}
+        self._collections_lock = threading.Lock()
+        self._reembed_thread = None
+        self.ingest_queue = None
+        self.extraction_stage = None
         try:
-            DATA_PATH.mkdir(exist_ok=True)
+            COLLECTIONS_PATH.mkdir(parents=True, exist_ok=True)
+            self.ingest_queue = IngestionQueue(INGEST_QUEUE_PATH)
+            pending = self.ingest_queue.recover()
+            if pending: self.log(f"AI Core: {pending} documents are still waiting to be processed.")
+            self.extraction_stage = ExtractionStage(PageTextCache(EXTRACTION_CACHE_PATH), ocr=TesseractOcr(OCR_LANGUAGE),
+                                                    log=lambda message: self.log(message))
+            if not self.extraction_stage.has_ocr:
+                self.log("AI Core: Tesseract not found; scanned PDFs will not be searchable.")
             self.log("AI Core: Loading SentenceTransformer model...")
             self.embedding_model = SentenceTransformer(EMBED_MODEL)
+            self.vector_dimension = self.embedding_model.get_sentence_embedding_dimension()
             self.log("AI Core: Model loaded successfully.")
-            self._load_state()
+            self._migrate_legacy_data()
+            self._discover_collections()
+            self._start_background_reembed()
         except Exception as e:
             self.log(f"[FATAL LOG] AI Core: Failed to initialize: {e}")
 
-    def _load_state(self):
-        if LIBRARY_FILE_PATH.exists() and INDEX_FILE_PATH.exists():
-            self.log(f"AI Core: Loading existing library and FAISS index...")
-            with open(LIBRARY_FILE_PATH, 'r') as f:
-                self.document_map = json.load(f)
-            self.index = faiss.read_index(str(INDEX_FILE_PATH))
-            if len(self.document_map) != self.index.ntotal:
-                self.log(f"[WARNING] Mismatch between library ({len(self.document_map)}) and index ({self.index.ntotal}). Rebuilding.")
-                self.index = faiss.IndexFlatL2(VECTOR_DIMENSION)
-                self.document_map = []
-                return
-            self.log(f"AI Core: Loaded {self.index.ntotal} vectors/documents.")
-        else:
-            self.log("AI Core: No existing library/index found. Creating new ones.")
-            self.index = faiss.IndexFlatL2(VECTOR_DIMENSION)
-            self.document_map = []
-
-    def _save_state(self):
-        self.log("AI Core: Saving state to disk...")
-        faiss.write_index(self.index, str(INDEX_FILE_PATH))
-        with open(LIBRARY_FILE_PATH, 'w') as f:
-            json.dump(self.document_map, f, indent=4)
-        self.log("AI Core: State saved successfully.")
-
-    def get_processed_files(self) -> list[str]:
-        if not self.document_map: return []
-        return sorted(list(set(item['metadata']['source'] for item in self.document_map)))
-
-    def is_file_processed(self, file_path: pathlib.Path) -> bool:
-        return any(item['metadata']['source'] == file_path.name for item in self.document_map)
-
-    def add_document(self, chunks: list[str], source_path: pathlib.Path):
-        if not self.embedding_model or self.index is None: return
-        for chunk in chunks:
-            self.document_map.append({
-                'document': chunk,
-                'metadata': {'source': source_path.name}
-            })
-        embeddings = self.embedding_model.encode(chunks)
-        self.index.add(embeddings.astype('float32'))
-        self._save_state()
-
-    def query(self, user_question: str, num_results: int = 3) -> list[dict]:
-        if self.index is None or self.index.ntotal == 0: return []
+    def _migrate_legacy_data(self):
+        """Moves the old single index from ./documind_data into the default collection."""
+        legacy_index = LEGACY_DATA_PATH / "documind_index.faiss"
+        legacy_library = LEGACY_DATA_PATH / "documind_library.json"
+        target = COLLECTIONS_PATH / DEFAULT_COLLECTION
+        if not (legacy_index.exists() and legacy_library.exists()) or target.exists():
+            return
+        self.log(f"AI Core: Migrating legacy library from {LEGACY_DATA_PATH.resolve()}...")
+        target.mkdir(parents=True)
+        shutil.copy2(legacy_index, target / INDEX_FILE_NAME)
+        shutil.copy2(legacy_library, target / LEGACY_LIBRARY_FILE_NAME)
+
+    def _discover_collections(self):
+        # Only register the collections here; their indexes are loaded on first use.
+        for path in sorted(COLLECTIONS_PATH.iterdir()):
+            if path.is_dir() and is_valid_collection_name(path.name):
+                self.collections[path.name] = self._make_collection(path.name, path)
+        if DEFAULT_COLLECTION not in self.collections:
+            self.create_collection(DEFAULT_COLLECTION)
+        self.log(f"AI Core: Found {len(self.collections)} libraries.")
+
+    def is_ready(self) -> bool:
+        """False when initialization failed part-way (e.g. the model could not be downloaded)."""
+        return (self.embedding_model is not None and DEFAULT_COLLECTION in self.collections
+                and self.ingest_queue is not None and self.extraction_stage is not None)
+
+    def set_status_callback(self, status_callback=None):
+        self.log = lambda message: print(f"[LOG] {message}") if status_callback is None else status_callback(message)
+
+    def _make_collection(self, name: str, path: pathlib.Path) -> Collection:
+        # Resolve `self.log` on every call so collections follow `set_status_callback`
+        return Collection(name, path, EMBED_MODEL, self.vector_dimension, lambda message: self.log(message), storage=VECTOR_STORAGE, use_mmap=USE_MMAP)
+
+    def _start_background_reembed(self):
+        """Re-embeds, in a daemon thread, every library whose manifest names a different model."""
+        stale = [collection for collection in self.collections.values() if collection.needs_reembed()]
+        if not stale: return
+        self.log(f"AI Core: {len(stale)} libraries were built with another embedding model; re-embedding in the background.")
+        def run():
+            for collection in stale:
+                try:
+                    collection.reembed(self.embedding_model.encode)
+                except Exception as e:
+                    self.log(f"[WARNING] AI Core: Re-embedding library '{collection.name}' failed: {e}")
+        self._reembed_thread = threading.Thread(target=run, name="documind-reembed", daemon=True)
+        self._reembed_thread.start()
+
+    def stale_collections(self, names: list[str] | None = None) -> list[str]:
+        """Libraries (of `names`, or all) that are not searchable until their re-embed finishes."""
+        names = self.list_collections() if names is None else names
+        return [name for name in names if name in self.collections and self.collections[name].needs_reembed()]
+
+    def list_collections(self) -> list[str]:
+        return sorted(self.collections)
+
+    def create_collection(self, name: str) -> Collection:
+        name = name.strip()
+        if not is_valid_collection_name(name):
+            raise ValueError(f"Invalid library name: {name!r}")
+        with self._collections_lock:
+            if name not in self.collections:
+                path = COLLECTIONS_PATH / name
+                path.mkdir(parents=True, exist_ok=True)
+                self.collections[name] = self._make_collection(name, path)
+            return self.collections[name]
+
+    def get_collection(self, name: str = DEFAULT_COLLECTION) -> Collection:
+        if name not in self.collections:
+            raise KeyError(f"Unknown library: {name!r}")
+        return self.collections[name]
+
+    def evict_idle_collections(self, max_idle_seconds: float = COLLECTION_IDLE_SECONDS) -> int:
+        """Unloads every collection that has not been used for `max_idle_seconds`."""
+        return sum(1 for collection in list(self.collections.values()) if collection.unload(max_idle_seconds))
+
+    def get_processed_files(self, collection: str = DEFAULT_COLLECTION) -> list[str]:
+        return self.get_collection(collection).get_processed_files()
+
+    def is_file_processed(self, file_path: pathlib.Path, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.get_collection(collection).is_file_processed(file_path)
+
+    def embed(self, chunks: list[str]) -> np.ndarray:
+        return self.embedding_model.encode(chunks)
+
+    def add_embeddings(self, chunks: list[str], embeddings: np.ndarray, source_path: pathlib.Path,
+                       collection: str = DEFAULT_COLLECTION, pages: list[int] | None = None,
+                       file_hash: str = "", tags: list[str] | None = None, commit: bool = True):
+        """Adds already embedded chunks of one document to a library; saved right away unless `commit` is False."""
+        self.get_collection(collection).add(chunks, embeddings, source_path, pages=pages, file_hash=file_hash,
+                                            tags=tags, commit=commit)
+
+    def commit_collection(self, collection: str = DEFAULT_COLLECTION) -> bool:
+        """Saves the documents added to a library with `commit=False`."""
+        return self.get_collection(collection).commit()
+
+    def add_document(self, chunks: list[str], source_path: pathlib.Path, collection: str = DEFAULT_COLLECTION,
+                     pages: list[int] | None = None, file_hash: str = "", tags: list[str] | None = None):
+        if not self.embedding_model: return
+        self.add_embeddings(chunks, self.embed(chunks), source_path, collection, pages=pages, file_hash=file_hash, tags=tags)
+
+    def query(self, user_question: str, num_results: int = 3, collections: list[str] | None = None,
+              metadata_filter: MetadataFilter | None = None) -> list[dict]:
+        """Searches one, several or (with `collections=None`) all libraries and merges the nearest chunks.
+
+        `metadata_filter` restricts the search to matching chunks before the vector search runs.
+        """
+        if not self.embedding_model: return []
+        names = self.list_collections() if collections is None else collections
+        targets = [self.collections[name] for name in names if name in self.collections]
+        if not targets: return []
         question_embedding = self.embedding_model.encode([user_question])
-        distances, indices = self.index.search(question_embedding.astype('float32'), num_results)
-        return [self.document_map[i] for i in indices[0] if i < len(self.document_map)]
+        results = []
+        for target in targets:
+            results.extend(target.search(question_embedding, num_results, metadata_filter))
+        results.sort(key=lambda result: result[0])
+        return [item for _, item in results[:num_results]]
 
     # --- THIS IS THE CORRECTED SYNCHRONOUS METHOD ---
     def generate_response(self, user_question: str, context: list[dict]) -> str:
@@ -85,8 +181,14 @@ class AICore:
             return "I couldn't find any relevant information in your documents to answer that question."
 
         context_str = "\n\n---\n\n".join([item['document'] for item in context])
-        sources = sorted(list(set([item['metadata']['source'] for item in context])))
-        sources_str = ", ".join(sources)
+        source_pages = {}
+        for item in context:
+            pages = source_pages.setdefault(item['metadata']['source'], set())
+            if item['metadata'].get('page'): pages.add(item['metadata']['page'])
+        sources_str = ", ".join(
+            f"{source} (p. {', '.join(str(p) for p in sorted(pages))})" if pages else source
+            for source, pages in sorted(source_pages.items())
+        )
 
         prompt = f""" Answer the user's question based only on the following context.
     If the context doesn't contain the answer, state that you don't have enough information.
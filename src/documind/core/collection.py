@@ -0,0 +1,503 @@
+import os
+import re
+import json
+import time
+import pathlib
+import threading
+from dataclasses import dataclass
+import numpy as np
+import faiss
+
+INDEX_FILE_NAME = "index.faiss"
+CHUNKS_FILE_NAME = "chunks.json"
+SOURCES_FILE_NAME = "sources.json"
+METADATA_FILE_NAME = "metadata.npz"
+MANIFEST_FILE_NAME = "manifest.json"
+LEGACY_LIBRARY_FILE_NAME = "library.json"
+FORMAT_VERSION = 1
+# Libraries written before the manifest existed were always built with this model
+LEGACY_MANIFEST = {'format_version': 0, 'embed_model': 'all-MiniLM-L6-v2', 'dimension': 384, 'vector_storage': 'float32'}
+VECTOR_STORAGES = {
+    'float32': None,
+    'float16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+# int8 codes need per-dimension ranges learned from data; until a library holds this many
+# vectors it stays float32, then it is trained on all of them and converted
+SQ8_MIN_TRAINING_VECTORS = 1000
+# Widen the learned ranges so later vectors slightly outside them are not clamped
+SQ8_RANGE_MARGIN = 0.1
+COLLECTION_NAME_PATTERN = re.compile(r"^[\w][\w \-]{0,63}$")
+
+def is_valid_collection_name(name: str) -> bool:
+    return bool(COLLECTION_NAME_PATTERN.match(name))
+
+@dataclass
+class MetadataFilter:
+    """Restricts a search to chunks whose metadata matches every given field.
+
+    `pages` is an inclusive (first, last) range of 1-based page numbers, the
+    ingestion bounds are Unix timestamps and `tags` matches documents carrying
+    any of the given tags.
+    """
+    sources: list[str] | None = None
+    pages: tuple[int, int] | None = None
+    ingested_after: float | None = None
+    ingested_before: float | None = None
+    tags: list[str] | None = None
+
+    def is_empty(self) -> bool:
+        return (self.sources is None and self.pages is None and self.ingested_after is None
+                and self.ingested_before is None and self.tags is None)
+
+def _replace_file(path: pathlib.Path, write):
+    """Writes via a temporary file and renames it into place.
+
+    Processes that still have the old file memory-mapped keep reading the old
+    inode instead of seeing a half-written one.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _write_json(path: pathlib.Path, data, indent: int | None = None):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=indent)
+    _replace_file(path, write)
+
+class Collection:
+    """A named, isolated library with its own FAISS index and chunk store.
+
+    The index and chunk store are only read from disk the first time the
+    collection is searched or written, and can be unloaded again when it sits
+    idle. Chunk metadata is kept in columnar arrays (one entry per vector id)
+    next to a small per-document source table, so filters can be turned into
+    an id selector before the vector search runs. The source table has its own
+    lock and is read on its own, so listing documents never loads the index or
+    waits for a save.
+
+    A manifest records the embedding model, dimension and vector storage the
+    index was built with. If the model changed, the collection is marked
+    stale: its chunks stay listed but are not searchable until `reembed`
+    has rebuilt the index with the current model.
+    """
+    def __init__(self, name: str, path: pathlib.Path, model_name: str, dimension: int, log,
+                 storage: str = 'float32', use_mmap: bool = False):
+        if storage not in VECTOR_STORAGES:
+            raise ValueError(f"Unknown vector storage: {storage!r}")
+        self.name = name
+        self.path = path
+        self.model_name = model_name
+        self.dimension = dimension
+        self.storage = storage
+        self.use_mmap = use_mmap
+        self.log = log
+        self.index = None
+        self.is_mmapped = False
+        self.is_stale = False
+        self.stale_manifest = None
+        self.is_reembedding = False
+        # Documents added with `commit=False` since the last save
+        self.uncommitted_documents = 0
+        self.lock = threading.RLock()
+        # Guards the source table only; never held while waiting for `lock`
+        self.sources_lock = threading.RLock()
+        self.sources: list[dict] = []
+        self.source_lookup: dict[str, int] = {}
+        self.sources_loaded = False
+        self.last_used = time.monotonic()
+        self._reset()
+
+    def _reset(self):
+        self.documents: list[str] = []
+        self.source_ids = np.empty(0, dtype=np.int32)
+        self.pages = np.empty(0, dtype=np.int32)
+        self.ingested_at = np.empty(0, dtype=np.float64)
+
+    @property
+    def index_file_path(self) -> pathlib.Path:
+        return self.path / INDEX_FILE_NAME
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        return self.path / MANIFEST_FILE_NAME
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.index is not None
+
+    def read_manifest(self) -> dict | None:
+        """Returns the on-disk header, or None for a collection that has never been saved."""
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        if self.index_file_path.exists() and (self.path / LEGACY_LIBRARY_FILE_NAME).exists():
+            return dict(LEGACY_MANIFEST)
+        return None
+
+    def needs_reembed(self) -> bool:
+        """Cheap check (manifest only) for whether the index was built with a different model."""
+        manifest = self.read_manifest()
+        return manifest is not None and (
+            manifest['embed_model'] != self.model_name or manifest['dimension'] != self.dimension)
+
+    def _set_sources(self, sources: list[dict]):
+        with self.sources_lock:
+            self.sources = sources
+            self.source_lookup = {source['name']: i for i, source in enumerate(sources)}
+            self.sources_loaded = True
+
+    def _read_committed_sources(self, manifest: dict) -> list[dict]:
+        with open(self.path / SOURCES_FILE_NAME, 'r') as f:
+            sources = json.load(f)
+        # Sources past the manifest's count were written by a save that never committed
+        return sources[:manifest.get('sources', len(sources))]
+
+    def _ensure_sources_loaded(self):
+        """Reads the source table on its own; the chunks and the index stay on disk."""
+        with self.sources_lock:
+            if self.sources_loaded: return
+            legacy_path = self.path / LEGACY_LIBRARY_FILE_NAME
+            if self.manifest_path.exists():
+                with open(self.manifest_path, 'r') as f:
+                    self._set_sources(self._read_committed_sources(json.load(f)))
+            elif legacy_path.exists() and self.index_file_path.exists():
+                self._set_sources(self._read_legacy_library(legacy_path)[1])
+            else:
+                self._set_sources([])
+
+    def _storage_for(self, count: int) -> str:
+        """The storage an index holding `count` vectors should use."""
+        if self.storage == 'int8' and count < SQ8_MIN_TRAINING_VECTORS:
+            return 'float32'
+        return self.storage
+
+    def _new_index(self, count: int = 0):
+        quantizer_type = VECTOR_STORAGES[self._storage_for(count)]
+        if quantizer_type is None:
+            return faiss.IndexFlatL2(self.dimension)
+        index = faiss.IndexScalarQuantizer(self.dimension, quantizer_type, faiss.METRIC_L2)
+        index.sq.rangestat = faiss.ScalarQuantizer.RS_minmax
+        index.sq.rangestat_arg = SQ8_RANGE_MARGIN
+        return index
+
+    def _build_index(self, vectors: np.ndarray):
+        index = self._new_index(len(vectors))
+        if len(vectors):
+            if not index.is_trained:
+                index.train(vectors)
+            index.add(vectors)
+        return index
+
+    def _read_index(self):
+        if self.use_mmap:
+            # Zero-copy view of the file: near-instant to open and shared through the page cache.
+            # The view is read-only, see `_ensure_writable`.
+            self.is_mmapped = True
+            return faiss.read_index(str(self.index_file_path), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        self.is_mmapped = False
+        return faiss.read_index(str(self.index_file_path))
+
+    def _ensure_writable(self):
+        if self.is_mmapped:
+            self.index = faiss.read_index(str(self.index_file_path))
+            self.is_mmapped = False
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def _ensure_loaded(self):
+        self.touch()
+        if self.index is None:
+            self._load_state()
+
+    def _load_state(self):
+        chunks_path = self.path / CHUNKS_FILE_NAME
+        legacy_path = self.path / LEGACY_LIBRARY_FILE_NAME
+        self.is_stale = False
+        self.is_mmapped = False
+        self.stale_manifest = None
+        self._reset()
+        if self.manifest_path.exists():
+            # The manifest is written last, so everything it covers is on disk
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if manifest['format_version'] > FORMAT_VERSION:
+                self.log(f"[WARNING] Library '{self.name}' was written by a newer version of DocuMind (format {manifest['format_version']}).")
+            self.log(f"AI Core: Loading library '{self.name}'...")
+            with open(chunks_path, 'r') as f:
+                self.documents = json.load(f)
+            self._set_sources(self._read_committed_sources(manifest))
+            with np.load(self.path / METADATA_FILE_NAME) as columns:
+                self.source_ids = columns['source_id']
+                self.pages = columns['page']
+                self.ingested_at = columns['ingested_at']
+        elif legacy_path.exists() and self.index_file_path.exists():
+            self.log(f"AI Core: Loading library '{self.name}'...")
+            manifest = dict(LEGACY_MANIFEST)
+            self.documents, sources, self.source_ids = self._read_legacy_library(legacy_path)
+            self._set_sources(sources)
+            self.pages = np.zeros(len(self.documents), dtype=np.int32)
+            self.ingested_at = np.zeros(len(self.documents), dtype=np.float64)
+        else:
+            # Never committed, or the first save was interrupted before its manifest
+            self._set_sources([])
+            self.index = self._new_index()
+            return
+        count = manifest.get('count', len(self.documents))
+        if manifest['embed_model'] != self.model_name or manifest['dimension'] != self.dimension:
+            # The old vectors are useless for the current model; keep the chunks and wait for `reembed`.
+            self.log(f"[WARNING] Library '{self.name}' was embedded with {manifest['embed_model']} ({manifest['dimension']}d). It needs re-embedding.")
+            self.index = self._new_index()
+            self.is_stale = True
+            self.stale_manifest = manifest
+            self._truncate(min(count, len(self.documents), len(self.source_ids)))
+            return
+        self.index = self._read_index()
+        self._truncate(min(count, len(self.documents), len(self.source_ids), self.index.ntotal))
+        if manifest['vector_storage'] != self._storage_for(self.index.ntotal):
+            self._convert_storage(manifest['vector_storage'])
+        self.log(f"AI Core: Loaded {self.index.ntotal} vectors from library '{self.name}'.")
+
+    def _truncate(self, count: int):
+        """Drops everything past the last committed chunk, e.g. files written by a save that was interrupted."""
+        lengths = (len(self.documents), len(self.source_ids), self.index.ntotal if not self.is_stale else count)
+        if max(lengths) == count:
+            return
+        self.log(f"[WARNING] Library '{self.name}' has uncommitted data (chunks/columns/index: {lengths}); keeping the first {count} chunks.")
+        self.documents = self.documents[:count]
+        self.source_ids = self.source_ids[:count]
+        self.pages = self.pages[:count]
+        self.ingested_at = self.ingested_at[:count]
+        # Sources are only ever appended, so those without chunks left are at the end
+        self._set_sources(self.sources[:int(self.source_ids.max()) + 1 if count else 0])
+        if not self.is_stale and self.index.ntotal > count:
+            self._ensure_writable()
+            self.index.remove_ids(faiss.IDSelectorRange(count, self.index.ntotal))
+
+    def _convert_storage(self, current_storage: str):
+        target = self._storage_for(self.index.ntotal)
+        self.log(f"AI Core: Converting library '{self.name}' from {current_storage} to {target} vectors...")
+        self.index = self._build_index(self.index.reconstruct_n(0, self.index.ntotal))
+        self.is_mmapped = False
+        self._save_state()
+
+    @staticmethod
+    def _read_legacy_library(legacy_path: pathlib.Path) -> tuple[list[str], list[dict], np.ndarray]:
+        """Converts the old list-of-dicts library file into chunks, a source table and source ids."""
+        with open(legacy_path, 'r') as f:
+            items = json.load(f)
+        documents, sources, source_lookup, source_ids = [], [], {}, []
+        for item in items:
+            name = item['metadata']['source']
+            if name not in source_lookup:
+                source_lookup[name] = len(sources)
+                sources.append({'name': name, 'file_hash': "", 'tags': []})
+            source_ids.append(source_lookup[name])
+            documents.append(item['document'])
+        return documents, sources, np.array(source_ids, dtype=np.int32)
+
+    def _save_state(self):
+        """Writes the library; the manifest goes last and acts as the commit record.
+
+        Every other file only grows between saves, so after an interrupted save
+        `_load_state` keeps the first `count` entries of each and drops the rest.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        def write_metadata(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, source_id=self.source_ids, page=self.pages, ingested_at=self.ingested_at)
+        _replace_file(self.path / METADATA_FILE_NAME, write_metadata)
+        _write_json(self.path / CHUNKS_FILE_NAME, self.documents)
+        with self.sources_lock:
+            source_count = len(self.sources)
+            _write_json(self.path / SOURCES_FILE_NAME, self.sources, indent=4)
+        if self.is_stale:
+            # A stale collection keeps its old index, and its manifest keeps naming the old model, until `reembed`
+            manifest = dict(self.stale_manifest, format_version=FORMAT_VERSION)
+        else:
+            _replace_file(self.index_file_path, lambda tmp_path: faiss.write_index(self.index, str(tmp_path)))
+            manifest = {
+                'format_version': FORMAT_VERSION,
+                'embed_model': self.model_name,
+                'dimension': self.dimension,
+                'vector_storage': self._storage_for(self.index.ntotal),
+            }
+        manifest['count'] = len(self.documents)
+        manifest['sources'] = source_count
+        _write_json(self.manifest_path, manifest, indent=4)
+        self.uncommitted_documents = 0
+        (self.path / LEGACY_LIBRARY_FILE_NAME).unlink(missing_ok=True)
+        self.log(f"AI Core: Library '{self.name}' saved.")
+
+    def unload(self, max_idle_seconds: float | None = None) -> bool:
+        """Drops the in-memory index and chunks (the small source table stays). With `max_idle_seconds`, only if the collection has been idle that long.
+
+        Never waits for the lock (this runs on the UI thread); a busy collection is simply skipped.
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.index is None or self.is_reembedding or self.uncommitted_documents:
+                return False
+            if max_idle_seconds is not None and time.monotonic() - self.last_used < max_idle_seconds:
+                return False
+            self.index = None
+            self.is_mmapped = False
+            self._reset()
+            self.log(f"AI Core: Unloaded idle library '{self.name}'.")
+            return True
+        finally:
+            self.lock.release()
+
+    # The source table lookups below run on the UI thread: they only take `sources_lock`,
+    # which a save holds just long enough to write sources.json.
+
+    def get_processed_files(self) -> list[str]:
+        with self.sources_lock:
+            self._ensure_sources_loaded()
+            return sorted(self.source_lookup)
+
+    def is_file_processed(self, file_path: pathlib.Path) -> bool:
+        with self.sources_lock:
+            self._ensure_sources_loaded()
+            return file_path.name in self.source_lookup
+
+    def get_tags(self, source: str) -> list[str]:
+        with self.sources_lock:
+            self._ensure_sources_loaded()
+            return list(self.sources[self.source_lookup[source]]['tags'])
+
+    def set_tags(self, source: str, tags: list[str]):
+        with self.sources_lock:
+            self._ensure_sources_loaded()
+            self.sources[self.source_lookup[source]]['tags'] = sorted(set(tags))
+            _write_json(self.path / SOURCES_FILE_NAME, self.sources, indent=4)
+
+    def add(self, chunks: list[str], embeddings: np.ndarray, source_path: pathlib.Path,
+            pages: list[int] | None = None, file_hash: str = "", tags: list[str] | None = None, commit: bool = True):
+        """Adds one document's chunks. With `commit=False` it is searchable but only saved by the next `commit`.
+
+        Every save rewrites the whole library, so bulk ingestion commits batches of documents instead of each one.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            name = source_path.name
+            with self.sources_lock:
+                if name not in self.source_lookup:
+                    self.source_lookup[name] = len(self.sources)
+                    self.sources.append({'name': name, 'file_hash': file_hash, 'tags': sorted(set(tags or []))})
+                source_id = self.source_lookup[name]
+            self.documents.extend(chunks)
+            self.source_ids = np.concatenate([self.source_ids, np.full(len(chunks), source_id, dtype=np.int32)])
+            self.pages = np.concatenate([self.pages, np.asarray(pages if pages is not None else [0] * len(chunks), dtype=np.int32)])
+            self.ingested_at = np.concatenate([self.ingested_at, np.full(len(chunks), time.time(), dtype=np.float64)])
+            if not self.is_stale:
+                # Vectors of a stale collection are recomputed by `reembed`
+                self._ensure_writable()
+                storage = self._storage_for(self.index.ntotal)
+                self.index.add(embeddings.astype('float32'))
+                if self._storage_for(self.index.ntotal) != storage:
+                    # Enough vectors to train the quantizer on; this also saves
+                    self._convert_storage(storage)
+                    return
+            if commit:
+                self._save_state()
+            else:
+                self.uncommitted_documents += 1
+
+    def commit(self) -> bool:
+        """Saves documents added with `commit=False`. Returns False if there was nothing to save."""
+        with self.lock:
+            if not self.uncommitted_documents:
+                return False
+            self._save_state()
+            return True
+
+    def reembed(self, encode, batch_size: int = 256):
+        """Rebuilds the index of a stale collection with `encode` (texts -> vectors).
+
+        Encoding runs without holding the lock so the collection stays usable;
+        chunks added in the meantime are picked up before the new index is installed.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            if not self.is_stale:
+                return
+            self.is_reembedding = True
+            texts = list(self.documents)
+        try:
+            self.log(f"AI Core: Re-embedding {len(texts)} chunks of library '{self.name}' with {self.model_name}...")
+            batches = [encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+            with self.lock:
+                if len(self.documents) > len(texts):
+                    batches.append(encode(self.documents[len(texts):]))
+                vectors = np.vstack(batches).astype('float32') if batches else np.empty((0, self.dimension), dtype='float32')
+                self.index = self._build_index(vectors)
+                self.is_mmapped = False
+                self.is_stale = False
+                self.stale_manifest = None
+                self._save_state()
+                self.log(f"AI Core: Library '{self.name}' re-embedded.")
+        finally:
+            self.is_reembedding = False
+
+    def _chunk(self, i: int) -> dict:
+        source = self.sources[self.source_ids[i]]
+        return {
+            'document': self.documents[i],
+            'metadata': {
+                'source': source['name'],
+                'page': int(self.pages[i]),
+                'file_hash': source['file_hash'],
+                'ingested_at': float(self.ingested_at[i]),
+                'tags': list(source['tags']),
+                'collection': self.name,
+            }
+        }
+
+    def _filter_mask(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        mask = np.ones(len(self.documents), dtype=bool)
+        if metadata_filter.sources is not None or metadata_filter.tags is not None:
+            allowed = set(range(len(self.sources)))
+            if metadata_filter.sources is not None:
+                allowed &= {self.source_lookup[s] for s in metadata_filter.sources if s in self.source_lookup}
+            if metadata_filter.tags is not None:
+                wanted = set(metadata_filter.tags)
+                allowed &= {i for i, source in enumerate(self.sources) if wanted.intersection(source['tags'])}
+            mask &= np.isin(self.source_ids, np.fromiter(allowed, dtype=np.int32, count=len(allowed)))
+        if metadata_filter.pages is not None:
+            first, last = metadata_filter.pages
+            mask &= (self.pages >= first) & (self.pages <= last)
+        if metadata_filter.ingested_after is not None:
+            mask &= self.ingested_at >= metadata_filter.ingested_after
+        if metadata_filter.ingested_before is not None:
+            mask &= self.ingested_at <= metadata_filter.ingested_before
+        return mask
+
+    def search(self, question_embedding: np.ndarray, num_results: int,
+               metadata_filter: MetadataFilter | None = None) -> list[tuple[float, dict]]:
+        """Returns `(distance, item)` pairs so results from several collections can be merged.
+
+        A metadata filter is applied inside FAISS through an `IDSelectorBitmap`,
+        so only matching vectors are scored and no over-fetching is needed.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            if self.is_stale or self.index.ntotal == 0:
+                return []
+            params = None
+            if metadata_filter is not None and not metadata_filter.is_empty():
+                mask = self._filter_mask(metadata_filter)
+                matches = int(mask.sum())
+                if matches == 0:
+                    return []
+                num_results = min(num_results, matches)
+                # The selector only holds a raw pointer, so `bitmap` must outlive the search call.
+                bitmap = np.packbits(mask, bitorder='little')
+                selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))  # size in bytes
+                params = faiss.SearchParameters(sel=selector)
+            distances, indices = self.index.search(question_embedding.astype('float32'), num_results, params=params)
+            return [(float(distance), self._chunk(i)) for distance, i in zip(distances[0], indices[0])
+                    if 0 <= i < len(self.documents)]
@@ -1,30 +1,129 @@
-import fitz
+import hashlib
+import threading
+import numpy as np
 from pathlib import Path
-from documind.core.ai_core import AICore
+from documind.core.ai_core import AICore, DEFAULT_COLLECTION
+from documind.core.ingest_queue import EMBEDDING
 
-def extract_text_from_pdf(pdf_path: Path) -> str | None:
-    try:
-        with fitz.open(pdf_path) as doc:
-            return "".join(page.get_text() for page in doc)
-    except Exception as e:
-        print(f"Error extracting text from {pdf_path.name}: {e}")
-        return None
+# Upper bound on extracted text waiting to be embedded. It keeps extraction from racing ahead of the
+# embedder; the chunks and vectors of the document being processed are still held until its commit.
+MAX_PENDING_TEXT_CHARS = 2_000_000
+EMBED_BATCH_SIZE = 64
+# A library save rewrites the whole library, so bulk ingestion saves once per this many
+# documents or seconds (whichever comes first) instead of after every document
+COMMIT_BATCH_DOCUMENTS = 25
+COMMIT_INTERVAL_SECONDS = 10.0
+
+class IngestionCancelled(Exception):
+    """Raised by `process_document` when `should_stop` asks it to abandon a document."""
+
+class PendingTextBuffer:
+    """Bounded hand-off of chunks from the extraction thread to the embedder.
+
+    `put` blocks while more than `max_chars` of text is waiting, which applies
+    backpressure to extraction when embedding is the slower stage.
+    """
+    def __init__(self, max_chars: int = MAX_PENDING_TEXT_CHARS):
+        self.max_chars = max_chars
+        self.items: list[tuple[str, int]] = []
+        self.pending_chars = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, chunks: list[str], page_number: int):
+        with self.condition:
+            # An oversized page is still accepted once the buffer has drained
+            while self.items and self.pending_chars >= self.max_chars and not self.closed:
+                self.condition.wait()
+            if self.closed: return
+            self.items.extend((chunk, page_number) for chunk in chunks)
+            self.pending_chars += sum(len(chunk) for chunk in chunks)
+            self.condition.notify_all()
+
+    def get(self, max_chunks: int) -> list[tuple[str, int]] | None:
+        """Waits for chunks and returns up to `max_chunks` of them, or None once closed and drained."""
+        with self.condition:
+            while not self.items and not self.closed:
+                self.condition.wait()
+            if not self.items: return None
+            batch, self.items = self.items[:max_chunks], self.items[max_chunks:]
+            self.pending_chars -= sum(len(chunk) for chunk, _ in batch)
+            self.condition.notify_all()
+            return batch
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 def chunk_text(text: str) -> list[str]:
     chunks = text.split('\n\n')
     return [chunk.strip() for chunk in chunks if len(chunk.strip()) > 150]
 
-def process_document(pdf_path: Path, ai_core: AICore):
-    """Orchestrates the processing of a single document."""
+def process_document(pdf_path: Path, ai_core: AICore, collection: str = DEFAULT_COLLECTION, tags: list[str] | None = None,
+                     should_stop=None, on_stage=None, max_pending_chars: int = MAX_PENDING_TEXT_CHARS,
+                     commit: bool = True, on_page_error=None) -> bool:
+    """Orchestrates the processing of a single document.
+
+    Pages are extracted through the cached, OCR-capable extraction stage and
+    chunked in a background thread while the caller embeds them in batches;
+    nothing reaches the library until the whole document is embedded and
+    added in one piece, so memory grows with the document's chunks and
+    vectors (only text waiting to be embedded is bounded). With
+    `commit=False` the library is not saved; the caller then commits a
+    batch of documents through `AICore.commit_collection`. `should_stop` is
+    polled between pages and batches and raises `IngestionCancelled`, and
+    `on_stage` is called with `EMBEDDING` when the first batch is embedded
+    (extraction of later pages may still be running). Pages that could not be
+    OCR'd are reported to `on_page_error(page_number, error)`. Returns False
+    if the document has no usable text.
+    """
+    should_stop = should_stop or (lambda: False)
     print(f"Processing document: {pdf_path.name}")
-    text = extract_text_from_pdf(pdf_path)
-    if not text:
-        return
+    file_hash = file_sha256(pdf_path)
+    buffer = PendingTextBuffer(max_pending_chars)
+    extraction_errors = []
+
+    def extract():
+        try:
+            for page_number, text in ai_core.extraction_stage.iter_pages(pdf_path, file_hash, should_stop, on_page_error):
+                if should_stop() or buffer.closed: return
+                page_chunks = chunk_text(text)
+                if page_chunks: buffer.put(page_chunks, page_number)
+        except Exception as e:
+            extraction_errors.append(e)
+        finally:
+            buffer.close()
+
+    extractor = threading.Thread(target=extract, name=f"extract-{pdf_path.name}", daemon=True)
+    extractor.start()
+    chunks, page_numbers, embeddings = [], [], []
+    try:
+        while (batch := buffer.get(EMBED_BATCH_SIZE)) is not None:
+            if should_stop(): raise IngestionCancelled(pdf_path.name)
+            if on_stage and not embeddings: on_stage(EMBEDDING)
+            batch_chunks = [chunk for chunk, _ in batch]
+            embeddings.append(ai_core.embed(batch_chunks))
+            chunks.extend(batch_chunks)
+            page_numbers.extend(page_number for _, page_number in batch)
+    finally:
+        buffer.close()
+        extractor.join()
+    if extraction_errors:
+        raise extraction_errors[0]
+    if should_stop(): raise IngestionCancelled(pdf_path.name)
 
-    chunks = chunk_text(text)
     if not chunks:
         print(f"Could not extract meaningful chunks from {pdf_path.name}.")
-        return
-    
-    # Call the new, more sensible add_document method
-    ai_core.add_document(chunks, pdf_path)
\ No newline at end of file
+        return False
+
+    ai_core.add_embeddings(chunks, np.vstack(embeddings), pdf_path, collection,
+                           pages=page_numbers, file_hash=file_hash, tags=tags, commit=commit)
+    return True
@@ -0,0 +1,166 @@
+import os
+import time
+import pathlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+from documind.core.sqlite_util import connect, create_database, placeholders
+
+# OCR workers are spawned: each re-imports this module and the launching module (documind.main,
+# which keeps its Qt/torch imports inside `run()`), so neither may import heavy packages at module level.
+
+TEXT_LAYER = "text-layer"
+# A page with less text than this that carries images is treated as a scan
+MIN_TEXT_LAYER_CHARS = 20
+OCR_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+OCR_NICENESS = 10
+
+class PageTextCache:
+    """Extracted page text keyed by the PDF's content hash and page number.
+
+    Re-adding a document, changing the chunker or re-embedding with another
+    model then never repeats the (possibly OCR-based) extraction. Each row
+    records its extractor, so OCR from another engine or language is not reused.
+    """
+    def __init__(self, db_path: pathlib.Path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        create_database(db_path, """
+            CREATE TABLE IF NOT EXISTS pages (
+                file_hash TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                extractor TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (file_hash, page)
+            )
+        """)
+
+    def get_document(self, file_hash: str, extractors: tuple[str, ...] | None = None) -> dict[int, str]:
+        """Returns the cached pages of a document as {page_number: text}, optionally only those from `extractors`."""
+        query, params = "SELECT page, text FROM pages WHERE file_hash = ?", [file_hash]
+        if extractors is not None:
+            query += f" AND extractor IN ({placeholders(extractors)})"
+            params.extend(extractors)
+        with self.lock, connect(self.db_path) as conn:
+            return dict(conn.execute(query, params))
+
+    def store(self, file_hash: str, pages: list[tuple[int, str, str]]):
+        """Stores `(page_number, extractor, text)` entries for one document."""
+        if not pages: return
+        now = time.time()
+        with self.lock, connect(self.db_path) as conn:
+            conn.executemany("INSERT OR REPLACE INTO pages (file_hash, page, extractor, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                             [(file_hash, page, extractor, text, now) for page, extractor, text in pages])
+
+class TesseractOcr:
+    """OCR through PyMuPDF's Tesseract integration; needs the `tesseract` binary and its language data."""
+    def __init__(self, language: str = "eng", dpi: int = 300):
+        self.language = language
+        self.dpi = dpi
+
+    @property
+    def name(self) -> str:
+        return f"ocr-tesseract-{self.language}"
+
+    def is_available(self) -> bool:
+        try:
+            return bool(fitz.get_tessdata())
+        except Exception:
+            return False
+
+    def ocr_page(self, pdf_path: str, page_index: int) -> str:
+        with fitz.open(pdf_path) as doc:
+            page = doc[page_index]
+            textpage = page.get_textpage_ocr(language=self.language, dpi=self.dpi, full=True)
+            return page.get_text(textpage=textpage)
+
+def _lower_priority():
+    # OCR is background work; let extraction of text-layer PDFs, embedding and the UI go first
+    if hasattr(os, "nice"):
+        os.nice(OCR_NICENESS)
+
+def is_image_only(page: fitz.Page, text: str) -> bool:
+    return len(text.strip()) < MIN_TEXT_LAYER_CHARS and bool(page.get_images())
+
+class ExtractionStage:
+    """Turns the pages of a PDF into text.
+
+    Pages come from the cache when possible, otherwise from the PDF's text
+    layer. Image-only pages are sent to the OCR engine in a separate pool of
+    low-priority worker processes, so scans neither block the text-layer
+    pages nor compete with the UI. Every newly extracted page is written
+    back to the cache.
+    """
+    def __init__(self, cache: PageTextCache, ocr=None, ocr_workers: int = OCR_WORKERS, log=print):
+        self.cache = cache
+        self.log = log
+        self.ocr = ocr if ocr is not None and ocr.is_available() else None
+        self.ocr_workers = ocr_workers
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def has_ocr(self) -> bool:
+        return self.ocr is not None
+
+    def _ocr_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn, not fork: the parent runs Qt and torch threads
+                self._pool = ProcessPoolExecutor(max_workers=self.ocr_workers, initializer=_lower_priority,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def iter_pages(self, pdf_path: pathlib.Path, file_hash: str, should_stop=None, on_error=None):
+        """Yields `(page_number, text)` for each page, 1-based. OCR'd pages may arrive after later text-layer pages.
+
+        A page whose OCR fails is skipped and reported to `on_error(page_number, error)`.
+        """
+        should_stop = should_stop or (lambda: False)
+        # OCR text from another engine or language is redone (and replaced); without OCR any cached text is better than none
+        cached = self.cache.get_document(file_hash, (TEXT_LAYER, self.ocr.name) if self.ocr is not None else None)
+        new_pages = []
+        ocr_jobs = {}
+        try:
+            with fitz.open(pdf_path) as doc:
+                for page in doc:
+                    if should_stop(): return
+                    page_number = page.number + 1
+                    if page_number in cached:
+                        yield page_number, cached[page_number]
+                        continue
+                    text = page.get_text()
+                    if is_image_only(page, text):
+                        if self.ocr is not None:
+                            ocr_jobs[self._ocr_pool().submit(self.ocr.ocr_page, str(pdf_path), page.number)] = page_number
+                        else:
+                            # Not cached, so the page is OCR'd once an engine becomes available
+                            yield page_number, text
+                        continue
+                    new_pages.append((page_number, TEXT_LAYER, text))
+                    yield page_number, text
+            for future, page_number in ocr_jobs.items():
+                while not future.done():
+                    if should_stop(): return
+                    time.sleep(0.1)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    self.log(f"[WARNING] OCR failed on page {page_number} of {pdf_path.name}: {e}")
+                    if on_error: on_error(page_number, e)
+                    continue
+                new_pages.append((page_number, self.ocr.name, text))
+                yield page_number, text
+        finally:
+            for future in ocr_jobs:
+                future.cancel()
+            # Even a cancelled document keeps the pages that were already paid for
+            self.cache.store(file_hash, new_pages)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
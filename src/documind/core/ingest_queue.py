@@ -0,0 +1,107 @@
+import json
+import time
+import pathlib
+import sqlite3
+import threading
+from documind.core.sqlite_util import connect, create_database, placeholders
+
+# --- Job states ---
+QUEUED = "queued"
+EXTRACTING = "extracting"
+EMBEDDING = "embedding"
+COMMITTED = "committed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (EXTRACTING, EMBEDDING)
+PENDING_STATES = (QUEUED,) + ACTIVE_STATES
+
+class IngestionQueue:
+    """Persistent queue of documents waiting to be added to a library.
+
+    Every file is a job row in a small SQLite database whose state moves
+    queued -> extracting -> embedding -> committed (or failed/cancelled).
+    A document only becomes visible in its library when it is committed, so
+    after a crash or an early exit any job left mid-way is simply re-queued
+    by `recover` and processed again from the start.
+    """
+    def __init__(self, db_path: pathlib.Path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        create_database(db_path, """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                tags TEXT NOT NULL DEFAULT '[]',
+                state TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """, "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def _connect(self):
+        return connect(self.db_path, row_factory=sqlite3.Row)
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job['tags'] = json.loads(job['tags'])
+        return job
+
+    def recover(self) -> int:
+        """Re-queues jobs interrupted mid-way and forgets finished ones. Returns the number of pending jobs."""
+        with self.lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET state = ?, updated_at = ? WHERE state IN ({placeholders(ACTIVE_STATES)})",
+                         (QUEUED, time.time(), *ACTIVE_STATES))
+            conn.execute("DELETE FROM jobs WHERE state IN (?, ?)", (COMMITTED, CANCELLED))
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUED,)).fetchone()[0]
+
+    def enqueue(self, paths: list[pathlib.Path], collection: str, tags: list[str] | None = None) -> list[pathlib.Path]:
+        """Queues files that are not already pending for `collection`, replacing earlier failures. Returns the paths added."""
+        now = time.time()
+        added = []
+        with self.lock, self._connect() as conn:
+            for path in paths:
+                pending = conn.execute(
+                    f"SELECT 1 FROM jobs WHERE path = ? AND collection = ? AND state IN ({placeholders(PENDING_STATES)})",
+                    (str(path), collection, *PENDING_STATES)).fetchone()
+                if pending: continue
+                conn.execute("DELETE FROM jobs WHERE path = ? AND collection = ? AND state = ?", (str(path), collection, FAILED))
+                conn.execute("INSERT INTO jobs (path, collection, tags, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             (str(path), collection, json.dumps(tags or []), QUEUED, now, now))
+                added.append(path)
+        return added
+
+    def claim_next(self) -> dict | None:
+        """Moves the oldest queued job to `extracting` and returns it."""
+        with self.lock, self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT 1", (QUEUED,)).fetchone()
+            if row is None: return None
+            conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (EXTRACTING, time.time(), row['id']))
+            job = self._to_job(row)
+            job['state'] = EXTRACTING
+            return job
+
+    def set_state(self, job_id: int, state: str, error: str | None = None):
+        with self.lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, time.time(), job_id))
+
+    def cancel_pending(self) -> int:
+        """Cancels every job that has not been committed yet."""
+        with self.lock, self._connect() as conn:
+            return conn.execute(f"UPDATE jobs SET state = ?, updated_at = ? WHERE state IN ({placeholders(PENDING_STATES)})",
+                                (CANCELLED, time.time(), *PENDING_STATES)).rowcount
+
+    def count(self, states: tuple[str, ...] = PENDING_STATES) -> int:
+        with self.lock, self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM jobs WHERE state IN ({placeholders(states)})", states).fetchone()[0]
+
+    def jobs(self, collection: str | None = None, states: tuple[str, ...] = PENDING_STATES + (FAILED,)) -> list[dict]:
+        query = f"SELECT * FROM jobs WHERE state IN ({placeholders(states)})"
+        params = list(states)
+        if collection is not None:
+            query += " AND collection = ?"
+            params.append(collection)
+        with self.lock, self._connect() as conn:
+            return [self._to_job(row) for row in conn.execute(query + " ORDER BY id", params)]
@@ -0,0 +1,25 @@
+import pathlib
+import sqlite3
+from contextlib import contextmanager
+
+@contextmanager
+def connect(db_path: pathlib.Path, row_factory=None):
+    """A short-lived connection that commits when the block succeeds and rolls back on error."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = row_factory
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def create_database(db_path: pathlib.Path, *statements: str):
+    """Switches the database to WAL, so readers never wait for the writer, and runs the schema `statements`."""
+    with connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in statements:
+            conn.execute(statement)
+
+def placeholders(values) -> str:
+    """`?, ?, ?` for binding each of `values` in an `IN (...)` clause."""
+    return ', '.join('?' * len(values))
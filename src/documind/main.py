@@ -1,14 +1,17 @@
 import sys
 import pathlib
-from PyQt6.QtCore import QThread
-from PyQt6.QtWidgets import QApplication
-
-from documind.ui.main_window import DocuMindApp
-from documind.ui.theme_manager import ThemeManager
-from documind.ui.splash_screen import SplashScreen, AppInitializer
+import multiprocessing
 
 def run():
     """Initializes and runs the DocuMind application with a splash screen."""
+    # Imported here, not at module level: OCR worker processes are spawned and re-import
+    # this module, and must not pull in Qt, torch and the sentence-transformers stack.
+    from PyQt6.QtCore import QThread
+    from PyQt6.QtWidgets import QApplication
+    from documind.ui.main_window import DocuMindApp
+    from documind.ui.theme_manager import ThemeManager
+    from documind.ui.splash_screen import SplashScreen, AppInitializer
+
     app = QApplication(sys.argv)
     
     # --- Splash Screen Setup ---
@@ -44,4 +47,5 @@ def run():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # lets the OCR pool start from a frozen (PyInstaller) build
     run()
\ No newline at end of file
@@ -1,68 +1,136 @@
 import sys
+import time
 import pathlib
 import traceback
 import asyncio
 import markdown
-from PyQt6.QtCore import Qt, QSize, QObject, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QSize, QObject, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QIcon, QFont
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QListWidget, QListWidgetItem, QLineEdit, QLabel, QSplitter,
-    QFileDialog, QProgressBar, QMessageBox, QListView
+    QFileDialog, QProgressBar, QMessageBox, QListView, QComboBox, QCheckBox,
+    QInputDialog, QMenu
 )
 from documind.ui.theme_manager import ThemeManager
-from documind.core.ai_core import AICore
-from documind.core.document_processor import process_document
+from documind.core.ai_core import AICore, DEFAULT_COLLECTION
+from documind.core.collection import MetadataFilter
+from documind.core.document_processor import (
+    process_document, IngestionCancelled, COMMIT_BATCH_DOCUMENTS, COMMIT_INTERVAL_SECONDS
+)
+from documind.core.ingest_queue import QUEUED, EXTRACTING, EMBEDDING, COMMITTED, FAILED, CANCELLED
 from documind.ui.custom_widgets import DocumentListItemWidget
 from documind.ui.chat_model import ChatModel
 from documind.ui.chat_delegate import ChatDelegate
 
 # ... (Worker classes are unchanged) ...
 class ProcessingWorker(QObject):
+    """Drains the persistent ingestion queue until it is empty, stopped or cancelled."""
     finished = pyqtSignal()
-    progress = pyqtSignal(int, str)
+    # Per-document signals lead with the job's library, since the user may be looking at another one
+    progress = pyqtSignal(int, str, str)
     error = pyqtSignal(str)
-    document_processed = pyqtSignal(str) 
-    def __init__(self, file_paths: list[str], ai_core: AICore):
+    document_processed = pyqtSignal(str, str)
+    document_stage = pyqtSignal(str, str, str)
+    document_failed = pyqtSignal(str, str, str)
+    def __init__(self, ai_core: AICore):
         super().__init__()
-        self.file_paths = file_paths
         self.ai_core = ai_core
+        self.queue = ai_core.ingest_queue
         self.is_running = True
+        self.is_cancelled = False
+    def should_stop(self) -> bool:
+        return not self.is_running
     def run(self):
+        # Added but not yet saved; they stay `embedding` in the queue (and are redone after a crash) until committed
+        uncommitted_jobs = []
+        last_commit = time.monotonic()
         try:
-            total_files = len(self.file_paths)
-            for i, path_str in enumerate(self.file_paths):
-                if not self.is_running: break
-                pdf_path = pathlib.Path(path_str)
-                self.progress.emit(int((i / total_files) * 100), f"Processing: {pdf_path.name}")
-                if not self.ai_core.is_file_processed(pdf_path):
-                    process_document(pdf_path, self.ai_core)
-                    self.document_processed.emit(pdf_path.name)
-                else:
-                    self.progress.emit(int((i / total_files) * 100), f"Skipping existing file: {pdf_path.name}")
-            if self.is_running: self.progress.emit(100, "Processing complete.")
+            completed = 0
+            while self.is_running:
+                job = self.queue.claim_next()
+                if job is None: break
+                pdf_path = pathlib.Path(job['path'])
+                # The queue may grow while we work, so recompute the total for every file
+                total_files = completed + self.queue.count()
+                self.progress.emit(int((completed / total_files) * 100), f"Processing: {pdf_path.name}", job['collection'])
+                page_errors = []
+                try:
+                    if self.ai_core.is_file_processed(pdf_path, job['collection']):
+                        self.queue.set_state(job['id'], COMMITTED)
+                        self.progress.emit(int((completed / total_files) * 100), f"Skipping existing file: {pdf_path.name}", job['collection'])
+                    elif process_document(pdf_path, self.ai_core, job['collection'], tags=job['tags'], should_stop=self.should_stop,
+                                          on_stage=lambda stage: self.on_stage(job, stage), commit=False,
+                                          on_page_error=lambda page_number, error: page_errors.append(f"page {page_number}: {error}")):
+                        uncommitted_jobs.append(job)
+                        self.document_processed.emit(job['collection'], pdf_path.name)
+                        if (len(uncommitted_jobs) >= COMMIT_BATCH_DOCUMENTS
+                                or time.monotonic() - last_commit >= COMMIT_INTERVAL_SECONDS):
+                            self.commit(uncommitted_jobs)
+                            last_commit = time.monotonic()
+                    else:
+                        reason = "No extractable text"
+                        if page_errors:
+                            reason += f" (OCR failed on {len(page_errors)} pages; first error: {page_errors[0]})"
+                        elif not self.ai_core.extraction_stage.has_ocr:
+                            reason += " (scanned PDFs need Tesseract OCR installed)"
+                        self.queue.set_state(job['id'], FAILED, reason)
+                        self.document_failed.emit(job['collection'], pdf_path.name, reason)
+                except IngestionCancelled:
+                    # Stopped (e.g. app closing): the job goes back to the queue and resumes next time
+                    self.queue.set_state(job['id'], CANCELLED if self.is_cancelled else QUEUED)
+                    break
+                except Exception as e:
+                    self.queue.set_state(job['id'], FAILED, str(e))
+                    self.document_failed.emit(job['collection'], pdf_path.name, str(e))
+                completed += 1
+            # Documents that finished before a stop or cancel are kept
+            self.commit(uncommitted_jobs)
+            if self.is_cancelled:
+                self.queue.cancel_pending()
+                self.progress.emit(100, "Processing cancelled.", "")
+            elif self.is_running: self.progress.emit(100, "Processing complete.", "")
         except Exception as e:
             self.error.emit(f"An error occurred in the processing thread:\n\n{traceback.format_exc()}")
         finally:
             self.finished.emit()
+    def commit(self, jobs: list[dict]):
+        """Saves the libraries the jobs were added to, then marks the jobs committed."""
+        for collection in {job['collection'] for job in jobs}:
+            self.ai_core.commit_collection(collection)
+        for job in jobs:
+            self.queue.set_state(job['id'], COMMITTED)
+        jobs.clear()
+    def on_stage(self, job: dict, stage: str):
+        self.queue.set_state(job['id'], stage)
+        self.document_stage.emit(job['collection'], pathlib.Path(job['path']).name, stage)
     def stop(self): self.is_running = False
+    def cancel(self):
+        self.is_cancelled = True
+        self.is_running = False
 
 class QueryWorker(QObject):
     finished = pyqtSignal(str)
-    def __init__(self, question: str, ai_core: AICore):
+    def __init__(self, question: str, ai_core: AICore, collections: list[str] | None = None,
+                 metadata_filter: MetadataFilter | None = None):
         super().__init__()
         self.question = question
         self.ai_core = ai_core
+        self.collections = collections
+        self.metadata_filter = metadata_filter
         self.is_cancelled = False
     def run(self):
         if self.is_cancelled:
             self.finished.emit("Query cancelled.")
             return
-        context = self.ai_core.query(self.question)
+        context = self.ai_core.query(self.question, collections=self.collections, metadata_filter=self.metadata_filter)
         if self.is_cancelled:
             self.finished.emit("Query cancelled.")
             return
         answer = self.ai_core.generate_response(self.question, context)
+        stale = self.ai_core.stale_collections(self.collections)
+        if stale:
+            answer += f"\n\n_Not searched: {', '.join(stale)} (still being re-embedded for the current model)._"
         if not self.is_cancelled:
             self.finished.emit(answer)
     def stop(self): self.is_cancelled = True
@@ -76,6 +144,7 @@ class DocuMindApp(QMainWindow):
         self.processing_thread, self.query_thread = None, None
         self.processing_worker, self.query_worker = None, None
         self.document_widgets = {}
+        self.current_collection = DEFAULT_COLLECTION
         self.setWindowTitle("DocuMind")
         self.setWindowIcon(QIcon(str(pathlib.Path(__file__).parent.parent / "assets" / "app_icon.png")))
         self.setGeometry(100, 100, 1200, 800)
@@ -87,7 +156,24 @@ class DocuMindApp(QMainWindow):
         self.setup_status_bar()
         self.splitter.setSizes([350, 850])
         self.update_icons()
+        self.populate_collection_selector()
         self.populate_document_list_from_library()
+        if not self.ai_core.is_ready():
+            # Keep the window usable enough to read the message instead of crashing on a half-initialized core
+            for widget in (self.add_files_button, self.new_collection_button, self.question_input, self.ask_button):
+                widget.setEnabled(False)
+            self.setAcceptDrops(False)
+            self.statusBar().showMessage("AI Core failed to initialize (is the embedding model available?). Restart to try again.")
+            return
+        # Pick up documents that were still queued when the app last closed (or crashed)
+        pending = self.ai_core.ingest_queue.count()
+        if pending:
+            self.statusBar().showMessage(f"Resuming processing of {pending} queued documents...", 5000)
+            self.start_processing()
+        # Periodically release the indexes of libraries nobody has touched in a while
+        self.eviction_timer = QTimer(self)
+        self.eviction_timer.timeout.connect(self.ai_core.evict_idle_collections)
+        self.eviction_timer.start(60 * 1000)
 
     def setup_right_pane(self):
         right_pane_container = QWidget()
@@ -134,7 +220,11 @@ class DocuMindApp(QMainWindow):
         self.question_input.setEnabled(False)
         self.statusBar().showMessage("Thinking...")
         self.query_thread = QThread()
-        self.query_worker = QueryWorker(question, self.ai_core)
+        selected = self.selected_document_names()
+        # Selected names belong to the current library; another library may hold a different file of the same name
+        collections = None if self.search_all_checkbox.isChecked() and not selected else [self.current_collection]
+        metadata_filter = MetadataFilter(sources=selected) if selected else None
+        self.query_worker = QueryWorker(question, self.ai_core, collections, metadata_filter)
         self.query_worker.moveToThread(self.query_thread)
         self.query_worker.finished.connect(self.on_query_finished)
         self.query_thread.started.connect(self.query_worker.run)
@@ -158,6 +248,11 @@ class DocuMindApp(QMainWindow):
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
         self.status_bar.addPermanentWidget(self.progress_bar)
+        self.cancel_processing_button = QPushButton("Cancel")
+        self.cancel_processing_button.setToolTip("Cancel processing of all queued documents")
+        self.cancel_processing_button.clicked.connect(self.cancel_processing)
+        self.cancel_processing_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_processing_button)
     def setup_left_pane(self):
         left_pane = QWidget()
         left_layout = QVBoxLayout(left_pane)
@@ -166,6 +261,17 @@ class DocuMindApp(QMainWindow):
         self.add_files_button.setIconSize(QSize(18, 18))
         self.add_files_button.clicked.connect(self.open_file_dialog)
         left_layout.addWidget(self.add_files_button)
+        left_layout.addWidget(QLabel("Library"))
+        collection_layout = QHBoxLayout()
+        self.collection_selector = QComboBox()
+        self.collection_selector.currentTextChanged.connect(self.on_collection_changed)
+        collection_layout.addWidget(self.collection_selector, 1)
+        self.new_collection_button = QPushButton("New...")
+        self.new_collection_button.clicked.connect(self.create_collection)
+        collection_layout.addWidget(self.new_collection_button)
+        left_layout.addLayout(collection_layout)
+        self.search_all_checkbox = QCheckBox("Search all libraries")
+        left_layout.addWidget(self.search_all_checkbox)
         left_layout.addWidget(QLabel("Documents"))
         self.file_list_widget = QListWidget()
         # Apply stylesheet to remove default item borders and padding
@@ -176,18 +282,81 @@ class DocuMindApp(QMainWindow):
                 background-color: transparent; /* Ensure item background doesn't interfere */
             }
         """)
+        self.file_list_widget.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)
+        self.file_list_widget.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.file_list_widget.customContextMenuRequested.connect(self.show_document_context_menu)
+        self.file_list_widget.itemSelectionChanged.connect(self.update_question_scope)
         left_layout.addWidget(self.file_list_widget)
         self.theme_toggle_button = QPushButton("Toggle Theme")
         self.theme_toggle_button.setIconSize(QSize(18, 18))
         self.theme_toggle_button.clicked.connect(self.toggle_theme)
         left_layout.addWidget(self.theme_toggle_button, alignment=Qt.AlignmentFlag.AlignBottom)
         self.splitter.addWidget(left_pane)
+    def populate_collection_selector(self):
+        self.collection_selector.blockSignals(True)
+        self.collection_selector.clear()
+        self.collection_selector.addItems(self.ai_core.list_collections())
+        self.collection_selector.setCurrentText(self.current_collection)
+        self.collection_selector.blockSignals(False)
+    def on_collection_changed(self, name: str):
+        if not name or name == self.current_collection: return
+        self.current_collection = name
+        self.populate_document_list_from_library()
+    def create_collection(self):
+        name, ok = QInputDialog.getText(self, "New Library", "Library name:")
+        if not ok or not name.strip(): return
+        try:
+            self.ai_core.create_collection(name)
+        except ValueError as e:
+            QMessageBox.warning(self, "New Library", str(e))
+            return
+        self.current_collection = name.strip()
+        self.populate_collection_selector()
+        self.populate_document_list_from_library()
     def populate_document_list_from_library(self):
         self.file_list_widget.clear()
         self.document_widgets.clear()
-        doc_names = self.ai_core.get_processed_files()
+        if not self.ai_core.is_ready(): return
+        if self.ai_core.stale_collections([self.current_collection]):
+            self.statusBar().showMessage(f"Library '{self.current_collection}' is being re-embedded for the current model and can't be searched yet.", 10000)
+        doc_names = self.ai_core.get_processed_files(self.current_collection)
         for name in doc_names:
             self.add_document_to_list(name, status="Ready")
+        for job in self.ai_core.ingest_queue.jobs(self.current_collection):
+            name = pathlib.Path(job['path']).name
+            self.add_document_to_list(name, status="Queued")
+            if job['state'] == FAILED:
+                self.update_document_status(name, "Failed", "#e74c3c")
+                self.document_widgets[name].status_label.setToolTip(job['error'] or "")
+    def selected_document_names(self) -> list[str]:
+        return [self.file_list_widget.itemWidget(item).name_label.text() for item in self.file_list_widget.selectedItems()]
+    def update_question_scope(self):
+        selected = self.selected_document_names()
+        # A selection scopes the question to the current library, whatever "Search all libraries" says
+        self.search_all_checkbox.setEnabled(not selected)
+        if not selected:
+            self.question_input.setPlaceholderText("Ask a question about your documents...")
+        elif len(selected) == 1:
+            self.question_input.setPlaceholderText(f"Ask a question about {selected[0]}...")
+        else:
+            self.question_input.setPlaceholderText(f"Ask a question about the {len(selected)} selected documents...")
+    def show_document_context_menu(self, position):
+        item = self.file_list_widget.itemAt(position)
+        if item is None: return
+        doc_name = self.file_list_widget.itemWidget(item).name_label.text()
+        menu = QMenu(self)
+        edit_tags_action = menu.addAction("Edit Tags...")
+        clear_selection_action = menu.addAction("Clear Selection")
+        action = menu.exec(self.file_list_widget.viewport().mapToGlobal(position))
+        if action == edit_tags_action: self.edit_document_tags(doc_name)
+        elif action == clear_selection_action: self.file_list_widget.clearSelection()
+    def edit_document_tags(self, doc_name: str):
+        collection = self.ai_core.get_collection(self.current_collection)
+        if not collection.is_file_processed(pathlib.Path(doc_name)): return
+        current = ", ".join(collection.get_tags(doc_name))
+        text, ok = QInputDialog.getText(self, "Edit Tags", f"Tags for {doc_name} (comma separated):", text=current)
+        if not ok: return
+        collection.set_tags(doc_name, [tag.strip() for tag in text.split(",") if tag.strip()])
     def add_document_to_list(self, doc_name: str, status: str = "Queued"):
         if doc_name in self.document_widgets: return
         icon = self.theme_manager.get_icon("document")
@@ -200,29 +369,57 @@ class DocuMindApp(QMainWindow):
         if doc_name in self.document_widgets:
             self.document_widgets[doc_name].set_status(status, color)
     def handle_files(self, file_paths: list[str]):
-        pdf_paths = [pathlib.Path(p) for p in file_paths if p.lower().endswith('.pdf')]
-        new_files_to_process = [p for p in pdf_paths if not self.ai_core.is_file_processed(p)]
+        if not self.ai_core.is_ready(): return
+        pdf_paths = []
+        for path in map(pathlib.Path, file_paths):
+            if path.is_dir(): pdf_paths.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() == '.pdf'))
+            elif path.suffix.lower() == '.pdf': pdf_paths.append(path)
+        new_files_to_process = [p for p in pdf_paths if not self.ai_core.is_file_processed(p, self.current_collection)]
         if not new_files_to_process:
             self.statusBar().showMessage("All selected files have already been processed.", 5000)
             return
-        for p in new_files_to_process:
+        # Files already pending keep their row and current status
+        for p in self.ai_core.ingest_queue.enqueue(new_files_to_process, self.current_collection):
             self.add_document_to_list(p.name, status="Queued")
-        self.add_files_button.setEnabled(False)
+            self.update_document_status(p.name, "Queued")
+        self.start_processing()
+    def start_processing(self):
+        # A running worker picks newly queued jobs up on its own
+        if self.processing_thread is not None: return
         self.progress_bar.setValue(0)
         self.progress_bar.setVisible(True)
+        self.cancel_processing_button.setVisible(True)
         self.processing_thread = QThread()
-        self.processing_worker = ProcessingWorker([str(p) for p in new_files_to_process], self.ai_core)
+        self.processing_worker = ProcessingWorker(self.ai_core)
         self.processing_worker.moveToThread(self.processing_thread)
         self.processing_thread.started.connect(self.processing_worker.run)
         self.processing_worker.finished.connect(self.on_processing_finished)
         self.processing_worker.progress.connect(self.update_progress_status)
         self.processing_worker.error.connect(self.on_processing_error)
-        self.processing_worker.document_processed.connect(lambda name: self.update_document_status(name, "Ready", "#2ecc71"))
+        self.processing_worker.document_processed.connect(self.on_document_processed)
+        self.processing_worker.document_stage.connect(self.on_document_stage)
+        self.processing_worker.document_failed.connect(self.on_document_failed)
         self.processing_thread.start()
-    def update_progress_status(self, value: int, text: str):
+    def on_document_processed(self, collection: str, doc_name: str):
+        if collection != self.current_collection: return
+        self.update_document_status(doc_name, "Ready", "#2ecc71")
+    def on_document_stage(self, collection: str, doc_name: str, stage: str):
+        if collection != self.current_collection: return
+        labels = {EXTRACTING: "Extracting...", EMBEDDING: "Embedding..."}
+        self.update_document_status(doc_name, labels.get(stage, stage), "#3498db")
+    def on_document_failed(self, collection: str, doc_name: str, reason: str):
+        if collection != self.current_collection: return
+        self.update_document_status(doc_name, "Failed", "#e74c3c")
+        if doc_name in self.document_widgets:
+            self.document_widgets[doc_name].status_label.setToolTip(reason)
+    def cancel_processing(self):
+        if self.processing_worker: self.processing_worker.cancel()
+        self.cancel_processing_button.setEnabled(False)
+        self.statusBar().showMessage("Cancelling...")
+    def update_progress_status(self, value: int, text: str, collection: str):
         self.progress_bar.setValue(value)
         self.statusBar().showMessage(text)
-        if text.startswith("Processing: "):
+        if collection == self.current_collection and text.startswith("Processing: "):
             doc_name = text.split("Processing: ", 1)[1]
             self.update_document_status(doc_name, "Processing...", "#3498db")
     def update_icons(self):
@@ -244,7 +441,7 @@ class DocuMindApp(QMainWindow):
         else: event.ignore()
     def dropEvent(self, event):
         if event.mimeData().hasUrls():
-            file_paths = [url.toLocalFile() for url in event.mimeData.urls()]
+            file_paths = [url.toLocalFile() for url in event.mimeData().urls()]
             self.handle_files(file_paths)
         else: event.ignore()
     def cancel_query(self):
@@ -253,13 +450,20 @@ class DocuMindApp(QMainWindow):
         self.on_query_finished("Query cancelled by user.")
     def on_processing_finished(self):
         self.statusBar().showMessage("Ready.", 5000)
-        self.add_files_button.setEnabled(True)
         self.progress_bar.setVisible(False)
+        self.cancel_processing_button.setVisible(False)
+        self.cancel_processing_button.setEnabled(True)
+        was_cancelled = self.processing_worker.is_cancelled if self.processing_worker else False
         if self.processing_thread:
             self.processing_thread.quit()
             self.processing_thread.wait()
             self.processing_thread = None
             self.processing_worker = None
+        if was_cancelled:
+            self.populate_document_list_from_library()
+        elif self.ai_core.ingest_queue.count((QUEUED,)):
+            # Files queued right as the worker ran out of jobs
+            self.start_processing()
     def on_processing_error(self, error_message):
         self.statusBar().showMessage("An error occurred during processing.")
         error_dialog = QMessageBox(self)
@@ -270,8 +474,12 @@ class DocuMindApp(QMainWindow):
         error_dialog.setStandardButtons(QMessageBox.StandardButton.Ok)
         error_dialog.exec()
     def closeEvent(self, event):
-        if self.processing_worker: self.processing_worker.stop()
+        # Stopping (not cancelling) leaves unfinished jobs queued so they resume on the next start
+        if self.processing_worker:
+            self.processing_worker.finished.disconnect(self.on_processing_finished)
+            self.processing_worker.stop()
         if self.processing_thread: self.processing_thread.quit(); self.processing_thread.wait()
         if self.query_worker: self.query_worker.stop()
         if self.query_thread: self.query_thread.quit(); self.query_thread.wait()
+        if self.ai_core.extraction_stage: self.ai_core.extraction_stage.shutdown()
         event.accept()
\ No newline at end of file
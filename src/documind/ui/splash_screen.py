@@ -23,6 +23,8 @@ class AppInitializer(QObject):
         
         status_update("Unfolding knowledge... Almost there!")
         time.sleep(1) # A brief moment for the user to see the final message
+        # Libraries load lazily and may re-embed in the background; don't route that to the splash
+        ai_core.set_status_callback(None)
 
         self.finished.emit(ai_core)
 